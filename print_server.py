@@ -9,13 +9,19 @@ Environment variables (used as defaults):
   PRINTER_BLUETOOTH   Bluetooth name prefix or address
   PRINTER_SERIAL      Serial port path
   PRINTER_MODEL       Model override
+  PRINTER_MTU         BLE write chunk size override (bytes)
+  PRINTER_BLE_INFLIGHT  BLE writes kept in flight (default: 8, 4 on macOS)
+  PRINTER_BLE_ADAPTER   BlueZ adapter to tune for throughput (default: hci0)
   PRINT_PORT          HTTP port (default: 8080)
   PRINT_HOST          Bind address (default: 0.0.0.0)
+  PRINT_MAX_QUEUE     Jobs accepted at once before answering 503 (default: 16, 0 = no limit)
 
 Modes
 -----
 QR + text  — include a "qr" field; the QR code fills the left half, text the right.
              "text" falls back to the "qr" value if omitted.
+QR only    — add "qronly=1" (or "qronly": true) alongside "qr"; the QR code
+             fills the full paper width and no text is printed.
 Text only  — omit "qr" entirely; text fills the full paper width.
              "text" may be a plain string (\\n and \\t are honoured) or a nested
              JSON object/array, which is formatted into readable plain text.
@@ -37,16 +43,32 @@ from __future__ import annotations
 
 import argparse
 import asyncio
-import json
+import contextlib
+import functools
+import math
 import os
+import signal
+import string
 import sys
 import tempfile
-import threading
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from collections import OrderedDict, defaultdict
+from collections.abc import AsyncIterator
+from concurrent.futures import Executor, ThreadPoolExecutor
 from pathlib import Path
-from urllib.parse import parse_qs, urlparse
+from typing import TYPE_CHECKING
 
-from PIL import Image, ImageDraw
+import numpy as np
+import uvicorn
+from PIL import Image, ImageDraw, ImageFont
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
+from starlette.routing import Route
+
+try:
+    import orjson as _json  # optional: faster parsing, straight from bytes
+except ImportError:
+    import json as _json
 
 sys.path.insert(0, str(Path(__file__).resolve().parent / "TiMini-Print"))
 
@@ -62,34 +84,59 @@ from timiniprint.font_utils import find_monospace_bold_font
 from timiniprint.models import PrinterModel, PrinterModelRegistry
 from timiniprint.print_job import PrintJobBuilder, PrintSettings
 
+if TYPE_CHECKING:
+    from bleak import BleakClient
+    from bleak.backends.characteristic import BleakGATTCharacteristic
+
 BLE_WRITE_UUID = "0000ae01-0000-1000-8000-00805f9b34fb"
 MAX_BODY_BYTES = 10_240  # 10 KB — enough for any reasonable label text
 BLE_PRINT_TIMEOUT = 60.0  # seconds before a stuck BLE job is abandoned
+# Requested BLE connection interval, in 1.25 ms units (7.5–11.25 ms). BlueZ
+# defaults to 30–50 ms, which caps how many packets go out per second.
+BLE_CONN_INTERVAL = (6, 9)
+PAYLOAD_CACHE_SIZE = 64  # rendered jobs kept for repeat prints of the same label
+GLYPH_CACHE_SIZE = 1024  # non-ASCII glyphs kept between jobs (about 1 KB each)
+# Write-without-response packets kept in flight; CoreBluetooth queues fewer than BlueZ
+BLE_INFLIGHT_DEFAULT = 4 if sys.platform == "darwin" else 8
+
+
+_PADS = tuple("  " * i for i in range(8))
 
 
 def _format_value(value: object, indent: int = 0) -> str:
-    """Recursively format a JSON value (dict, list, or scalar) as plain text."""
-    pad = "  " * indent
+    """Format a JSON value (dict, list, or scalar) as plain text."""
     if isinstance(value, str):
         return value
+    if not isinstance(value, (dict, list)):
+        return str(value)
+    lines: list[str] = []
+    _format_lines(lines, value, indent)
+    return "\n".join(lines)
+
+
+def _format_lines(lines: list[str], value: dict | list, indent: int) -> None:
+    """Append the lines for a dict or list to lines, in a single pass."""
+    pad = _PADS[indent] if indent < len(_PADS) else "  " * indent
     if isinstance(value, dict):
-        lines = []
         for k, v in value.items():
             if isinstance(v, (dict, list)):
                 lines.append(f"{pad}{k}:")
-                lines.append(_format_value(v, indent + 1))
+                _format_nested(lines, v, indent + 1)
             else:
                 lines.append(f"{pad}{k}: {v}")
-        return "\n".join(lines)
-    if isinstance(value, list):
-        lines = []
+    else:
         for item in value:
             if isinstance(item, (dict, list)):
-                lines.append(_format_value(item, indent))
+                _format_nested(lines, item, indent)
             else:
                 lines.append(f"{pad}{item}")
-        return "\n".join(lines)
-    return str(value)
+
+
+def _format_nested(lines: list[str], value: dict | list, indent: int) -> None:
+    start = len(lines)
+    _format_lines(lines, value, indent)
+    if len(lines) == start:
+        lines.append("")  # an empty nested container still takes up a line
 
 
 def _text_lines(text: str, columns: int) -> list[str]:
@@ -99,220 +146,665 @@ def _text_lines(text: str, columns: int) -> list[str]:
         expanded = raw.expandtabs(4)
         if not expanded.strip():
             result.append("")
+        elif len(expanded) <= columns:
+            result.append(expanded)  # fits already; most label/receipt lines do
         else:
             result.extend(wrap_text_lines(expanded, columns))
     return result
 
 
-def compose_image(display_text: str, qr_data: str | None, printer_width: int) -> Image.Image:
-    """Compose the print image.
+@functools.cache
+def _registry() -> PrinterModelRegistry:
+    return PrinterModelRegistry.load()
 
-    When qr_data is provided: QR code on the left half, text on the right.
-    When qr_data is None: text only, spanning the full paper width.
+
+@functools.cache
+def _require_model(override: str | None) -> PrinterModel:
+    return require_model(_registry(), override)
+
+
+@functools.cache
+def _resolve_model(name: str, override: str | None) -> PrinterModel:
+    return resolve_model(_registry(), name, override)
+
+
+@functools.lru_cache(maxsize=1)
+def _font_path() -> str:
+    return find_monospace_bold_font()
+
+
+@functools.lru_cache(maxsize=16)
+def _text_font(width: int) -> tuple[ImageFont.FreeTypeFont, int, int]:
+    """Return (font, columns, line_height) for a text area of the given width.
+
+    A printer only ever uses two widths (full paper and the half beside a
+    QR code), so after the first few jobs this is a dictionary lookup.
     """
-    if qr_data is not None:
-        try:
-            import qrcode
-        except ImportError:
-            raise RuntimeError("qrcode is required: pip install 'qrcode[pil]'")
-        qr_size = printer_width // 2
-        qr = qrcode.QRCode(border=1)
-        qr.add_data(qr_data)
-        qr.make(fit=True)
-        qr_img = qr.make_image(fill_color="black", back_color="white").convert("L")
-        qr_img = qr_img.resize((qr_size, qr_size), Image.LANCZOS)
-        text_area_width = printer_width - qr_size
-    else:
-        qr_size = 0
-        text_area_width = printer_width
+    columns = columns_for_width(width)
+    font = fit_truetype_font(_font_path(), width, columns)
+    return font, columns, font_line_height(font)
+
+
+def _render_glyph(font: ImageFont.FreeTypeFont, ch: str, lh: int) -> tuple[np.ndarray, float]:
+    """Render one character as a one-line-tall black-on-white cell, with its advance width."""
+    advance = font.getlength(ch)
+    cell = Image.new("L", (max(1, math.ceil(advance), font.getbbox(ch)[2]), lh), 255)
+    ImageDraw.Draw(cell).text((0, 0), ch, font=font, fill=0)
+    return np.asarray(cell), advance
 
-    font_path = find_monospace_bold_font()
-    columns = columns_for_width(text_area_width)
-    font = fit_truetype_font(font_path, text_area_width, columns)
-    lines = _text_lines(display_text, columns)
-    lh = font_line_height(font)
-    text_block_height = max(1, lh * len(lines))
 
-    text_img = Image.new("L", (text_area_width, text_block_height), 255)
-    draw = ImageDraw.Draw(text_img)
-    y = 0
-    for line in lines:
-        draw.text((0, y), line, font=font, fill=0)
-        y += lh
+@functools.lru_cache(maxsize=16)
+def _glyph_atlas(width: int) -> dict[str, tuple[np.ndarray, float]]:
+    """Pre-rendered printable ASCII glyphs for the text font at this width.
 
+    Never added to after it is built; other characters go through
+    _extra_glyph, whose cache is bounded.
+    """
+    font, _, lh = _text_font(width)
+    return {ch: _render_glyph(font, ch, lh) for ch in string.printable if not ch.isspace()}
+
+
+@functools.lru_cache(maxsize=GLYPH_CACHE_SIZE)
+def _extra_glyph(width: int, ch: str) -> tuple[np.ndarray, float]:
+    # Clients can send any Unicode, so only the most recent glyphs are kept
+    font, _, lh = _text_font(width)
+    return _render_glyph(font, ch, lh)
+
+
+def _draw_qr(area: np.ndarray, qr_data: str) -> None:
+    """Draw a QR code for qr_data into a square, white area of the canvas."""
+    try:
+        import qrcode
+    except ImportError:
+        raise RuntimeError("qrcode is required: pip install 'qrcode[pil]'")
+    qr = qrcode.QRCode(border=1)
+    qr.add_data(qr_data)
+    qr.make(fit=True)
+    # Scale the module matrix (border included) up by the largest whole
+    # number that fits and centre it on white, so every module is the same
+    # size with hard edges; smoothing filters blur them and hurt scanning.
+    pixels = np.where(np.asarray(qr.get_matrix(), dtype=bool), 0, 255).astype(np.uint8)
+    qr_size = len(area)
+    scale = qr_size // len(pixels)
+    if scale == 0:
+        # Too many modules for one pixel each; squeeze as a last resort
+        area[...] = np.asarray(Image.fromarray(pixels).resize((qr_size, qr_size), Image.NEAREST))
+        return
+    pixels = pixels.repeat(scale, axis=0).repeat(scale, axis=1)
+    offset = (qr_size - len(pixels)) // 2
+    area[offset : offset + len(pixels), offset : offset + len(pixels)] = pixels
+
+
+def _draw_text(area: np.ndarray, lines: list[str]) -> None:
+    """Draw pre-wrapped lines into a white area of the canvas from the glyph atlas.
+
+    Cached glyph cells are stamped in place rather than rasterising every
+    character through FreeType again on each job.
+    """
+    width = area.shape[1]
+    _, _, lh = _text_font(width)
+    glyphs = _glyph_atlas(width)
+    for row, line in enumerate(lines):
+        y = row * lh
+        x = 0.0
+        for ch in line:
+            glyph = glyphs.get(ch)
+            if glyph is None:
+                glyph = _extra_glyph(width, ch)
+            cell, advance = glyph
+            left = round(x)
+            w = min(cell.shape[1], width - left)
+            if w > 0 and not ch.isspace():
+                # Darken only, so a glyph overhanging its cell can't erase a neighbour
+                region = area[y : y + lh, left : left + w]
+                np.minimum(region, cell[:, :w], out=region)
+            x += advance
+
+
+def _layout(
+    display_text: str, qr_data: str | None, printer_width: int
+) -> tuple[np.ndarray, np.ndarray | None, np.ndarray, list[str]]:
+    """Wrap the text and allocate the white canvas for it.
+
+    Returns (canvas, qr_area, text_area, lines). The areas are views into
+    the canvas, with the shorter of the QR code and the text block centred
+    vertically; qr_area is None in text-only mode.
+    """
+    qr_size = printer_width // 2 if qr_data is not None else 0
+    text_width = printer_width - qr_size
+    _, columns, lh = _text_font(text_width)
+    lines = _text_lines(display_text, columns)
+    text_height = max(1, lh * len(lines))
+    height = max(qr_size, text_height)
+
+    canvas = np.full((height, printer_width), 255, dtype=np.uint8)
+    y = (height - text_height) // 2
+    text_area = canvas[y : y + text_height, qr_size:]
+    qr_area = None
     if qr_data is not None:
-        total_height = max(qr_size, text_block_height)
-        out = Image.new("L", (printer_width, total_height), 255)
-        out.paste(qr_img, (0, (total_height - qr_size) // 2))
-        out.paste(text_img, (qr_size, (total_height - text_block_height) // 2))
-        return out
+        y = (height - qr_size) // 2
+        qr_area = canvas[y : y + qr_size, :qr_size]
+    return canvas, qr_area, text_area, lines
 
-    return text_img
 
+def compose_image(
+    display_text: str, qr_data: str | None, printer_width: int, qr_only: bool = False
+) -> Image.Image:
+    """Compose the print image.
 
-def build_print_data(display_text: str, qr_data: str | None, model: PrinterModel) -> bytes:
-    printer_width = PrintJobBuilder._normalized_width(model.width)
-    img = compose_image(display_text, qr_data, printer_width)
+    When qr_data is provided: QR code on the left half, text on the right.
+    When qr_data is None: text only, spanning the full paper width.
+    When qr_only is set: the QR code alone, spanning the full paper width.
+    """
+    if qr_only and qr_data is not None:
+        canvas = np.full((printer_width, printer_width), 255, dtype=np.uint8)
+        _draw_qr(canvas, qr_data)
+        return Image.fromarray(canvas)
+    canvas, qr_area, text_area, lines = _layout(display_text, qr_data, printer_width)
+    if qr_area is not None:
+        _draw_qr(qr_area, qr_data)
+    _draw_text(text_area, lines)
+    return Image.fromarray(canvas)
+
+
+async def compose_image_async(
+    display_text: str,
+    qr_data: str | None,
+    printer_width: int,
+    qr_only: bool = False,
+    executor: Executor | None = None,
+) -> Image.Image:
+    """Like compose_image, but draws the QR code and text concurrently in worker threads.
+
+    The threads come from executor, or the event loop's default executor if None.
+    """
+    loop = asyncio.get_running_loop()
+    if qr_only and qr_data is not None:
+        canvas = np.full((printer_width, printer_width), 255, dtype=np.uint8)
+        await loop.run_in_executor(executor, _draw_qr, canvas, qr_data)
+        return Image.fromarray(canvas)
+    # Text wrapping measures every line, so keep that off the event loop too
+    canvas, qr_area, text_area, lines = await loop.run_in_executor(
+        executor, _layout, display_text, qr_data, printer_width
+    )
+    # The two areas don't overlap, so both threads can draw into the canvas at once
+    jobs = [loop.run_in_executor(executor, _draw_text, text_area, lines)]
+    if qr_area is not None:
+        jobs.append(loop.run_in_executor(executor, _draw_qr, qr_area, qr_data))
+    await asyncio.gather(*jobs)
+    return Image.fromarray(canvas)
+
+
+def _encode_image(img: Image.Image, builder: PrintJobBuilder) -> bytes:
+    # The printer only does black or white. Threshold here, in C, so the
+    # builder gets a ready 1-bit image (nothing left for it to dither) and
+    # any temporary PNG is an eighth of the size to encode and decode.
+    img = img.convert("1", dither=Image.Dither.NONE)
+    # Hand the image over in memory when TiMini-Print supports it; older
+    # releases only accept a path, so fall back to a temporary PNG.
+    build_from_image = getattr(builder, "build_from_image", None)
+    if build_from_image is not None:
+        return build_from_image(img)
     with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as f:
         tmp_path = f.name
     try:
-        img.save(tmp_path)
-        return PrintJobBuilder(model, PrintSettings()).build_from_file(tmp_path)
+        # The file is read back once and deleted, so spend as little as
+        # possible on compression (the default level 6 dominates the cost)
+        img.save(tmp_path, compress_level=1)
+        return builder.build_from_file(tmp_path)
     finally:
         os.unlink(tmp_path)
 
 
+def build_print_data(
+    display_text: str, qr_data: str | None, model: PrinterModel, qr_only: bool = False
+) -> bytes:
+    printer_width = PrintJobBuilder._normalized_width(model.width)
+    img = compose_image(display_text, qr_data, printer_width, qr_only)
+    return _encode_image(img, PrintJobBuilder(model, PrintSettings()))
+
+
+def _request_fast_conn_interval(adapter: str) -> tuple[str, str] | None:
+    """Ask BlueZ for a short connection interval on the adapter's new connections.
+
+    Returns the previous (min, max) values for _restore_conn_interval, or
+    None if nothing was changed. This goes through debugfs, which needs
+    root; without it printing still works, just more slowly.
+    """
+    base = Path("/sys/kernel/debug/bluetooth") / adapter
+    low, high = BLE_CONN_INTERVAL
+    try:
+        saved = (
+            (base / "conn_min_interval").read_text().strip(),
+            (base / "conn_max_interval").read_text().strip(),
+        )
+    except (FileNotFoundError, PermissionError):
+        # The usual case in the non-root container, so not worth a warning
+        print(f"[BLE] debugfs not available; using the default connection interval on {adapter}.", flush=True)
+        return None
+    except OSError as exc:
+        print(f"[BLE] Could not set connection interval on {adapter}: {exc}", file=sys.stderr, flush=True)
+        return None
+    min_written = False
+    try:
+        # min first: the kernel rejects a max below the current min
+        (base / "conn_min_interval").write_text(f"{low}\n")
+        min_written = True
+        (base / "conn_max_interval").write_text(f"{high}\n")
+    except OSError as exc:
+        print(f"[BLE] Could not set connection interval on {adapter}: {exc}", file=sys.stderr, flush=True)
+        if min_written:
+            with contextlib.suppress(OSError):
+                (base / "conn_min_interval").write_text(f"{saved[0]}\n")
+        return None
+    return saved
+
+
+def _restore_conn_interval(adapter: str, saved: tuple[str, str]) -> None:
+    """Put back the connection interval saved by _request_fast_conn_interval."""
+    base = Path("/sys/kernel/debug/bluetooth") / adapter
+    low, high = saved
+    try:
+        # max first: the kernel rejects a min above the current max
+        (base / "conn_max_interval").write_text(f"{high}\n")
+        (base / "conn_min_interval").write_text(f"{low}\n")
+    except OSError as exc:
+        print(f"[BLE] Could not restore connection interval on {adapter}: {exc}", file=sys.stderr, flush=True)
+
+
+def _raise_first_error(done: set[asyncio.Task[None]], pending: dict[asyncio.Task[None], int]) -> None:
+    """Drop finished writes from pending, raising the error of the earliest chunk that failed.
+
+    Every finished write's exception is retrieved, not just the one raised.
+    """
+    failed = []
+    for task in done:
+        offset = pending.pop(task)
+        exc = task.exception()
+        if exc is not None:
+            failed.append((offset, exc))
+    if failed:
+        raise min(failed, key=lambda item: item[0])[1]
+
+
 class PrintServer:
     def __init__(self, args: argparse.Namespace) -> None:
         self.args = args
-        self._registry = PrinterModelRegistry.load()
-        self._lock = threading.Lock()
-
-    def print_text(self, display_text: str, qr_data: str | None) -> None:
-        with self._lock:
+        _registry()  # load the model database up front, not on the first job
+        # Adapter-wide debugfs settings to put back on shutdown
+        self._saved_conn_interval: tuple[str, str] | None = None
+        if args.bluetooth and not args.serial and sys.platform.startswith("linux"):
+            self._saved_conn_interval = _request_fast_conn_interval(args.ble_adapter)
+        # One lock per device: a printer can only take one stream at a time
+        self._locks: defaultdict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._jobs = 0  # accepted jobs not yet finished: rendering, queued or printing
+        # Rendering gets its own threads so the next job can be composed while
+        # the current one is transmitting. Two is enough for the QR code and
+        # text of one job at a time, and keeps later jobs queued in order.
+        self._render_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="render")
+        self._builders: dict[int, PrintJobBuilder] = {}
+        self._payloads: OrderedDict[tuple[str, str | None, bool, int], bytes] = OrderedDict()
+        # The model never changes for a serial printer; a BLE one is known
+        # once it has been discovered.
+        self._model: PrinterModel | None = None
+        if args.serial:
+            self._model = _require_model(args.model)
+        # BLE connection state, kept for the life of the process
+        self._client: BleakClient | None = None
+        self._address: str | None = None
+        self._char: BleakGATTCharacteristic | None = None
+        self._write_without_response = False
+        self._payload_size = 20  # largest single write, from the negotiated ATT MTU
+        self._connect_lock = asyncio.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return 0 < self.args.max_queue <= self._jobs
+
+    async def print_text(self, display_text: str, qr_data: str | None, qr_only: bool = False) -> None:
+        self._jobs += 1
+        try:
+            await self._print_text(display_text, qr_data, qr_only)
+        finally:
+            self._jobs -= 1
+
+    async def _print_text(self, display_text: str, qr_data: str | None, qr_only: bool) -> None:
+        target = self.args.serial or self.args.bluetooth
+        model = self._model if self.args.serial else await self._ble_model()
+        data = await self._payload(display_text, qr_data, qr_only, model)
+        async with self._locks[target]:
             if self.args.serial:
-                self._print_serial(display_text, qr_data)
+                await self._print_serial(data, model)
             else:
-                asyncio.run(asyncio.wait_for(self._print_ble(display_text, qr_data), timeout=BLE_PRINT_TIMEOUT))
-
-    def _print_serial(self, display_text: str, qr_data: str | None) -> None:
-        model = require_model(self._registry, self.args.model)
-        data = build_print_data(display_text, qr_data, model)
-        write_serial_blocking(
-            self.args.serial, data, model.img_mtu or 180, model.interval_ms or 4
+                await asyncio.wait_for(self._print_ble(data, model), timeout=BLE_PRINT_TIMEOUT)
+
+    async def _payload(
+        self, display_text: str, qr_data: str | None, qr_only: bool, model: PrinterModel
+    ) -> bytes:
+        """Return the printer bytes for a job, rendering only on a cache miss."""
+        # Models come from the process-wide registry, so identity is a stable key
+        key = (display_text, qr_data, qr_only, id(model))
+        data = self._payloads.get(key)
+        if data is not None:
+            self._payloads.move_to_end(key)
+            return data
+        # Rendering doesn't touch the device, so it runs in the render pool
+        # outside the lock and overlaps with any job already printing.
+        # Size the image for the model being printed to, which is what the key records
+        printer_width = PrintJobBuilder._normalized_width(model.width)
+        img = await compose_image_async(display_text, qr_data, printer_width, qr_only, self._render_pool)
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(self._render_pool, _encode_image, img, self._builder(model))
+        self._payloads[key] = data
+        if len(self._payloads) > PAYLOAD_CACHE_SIZE:
+            self._payloads.popitem(last=False)
+        return data
+
+    def _builder(self, model: PrinterModel) -> PrintJobBuilder:
+        # A builder is configured only by its model and settings, so reuse one per model
+        builder = self._builders.get(id(model))
+        if builder is None:
+            builder = self._builders[id(model)] = PrintJobBuilder(model, PrintSettings())
+        return builder
+
+    async def start(self) -> None:
+        """Find and connect to a BLE printer ahead of the first job."""
+        if self.args.serial:
+            return
+        try:
+            await self._connect()
+        except Exception as exc:
+            print(f"[BLE] Printer not ready yet, will retry on first job: {exc}", file=sys.stderr, flush=True)
+
+    def clear_caches(self) -> None:
+        """Drop rendered payloads, builders and font/glyph caches (e.g. after installing fonts)."""
+        self._payloads.clear()
+        self._builders.clear()
+        _font_path.cache_clear()
+        _text_font.cache_clear()
+        _glyph_atlas.cache_clear()
+        _extra_glyph.cache_clear()
+        print("Render caches cleared.", flush=True)
+
+    async def close(self) -> None:
+        self._render_pool.shutdown(wait=False, cancel_futures=True)
+        client, self._client = self._client, None
+        if client is not None and client.is_connected:
+            await client.disconnect()
+        saved, self._saved_conn_interval = self._saved_conn_interval, None
+        if saved is not None:
+            _restore_conn_interval(self.args.ble_adapter, saved)
+
+    async def _print_serial(self, data: bytes, model: PrinterModel) -> None:
+        # pyserial is blocking; keep it off the event loop
+        await asyncio.to_thread(
+            write_serial_blocking,
+            self.args.serial, data, model.img_mtu or 180, model.interval_ms or 4,
         )
 
-    async def _print_ble(self, display_text: str, qr_data: str | None) -> None:
-        from bleak import BleakClient, BleakScanner
+    async def _discover(self) -> tuple[str, PrinterModel]:
+        """Scan for the configured printer and return (address, model)."""
+        from bleak import BleakScanner
 
         target = self.args.bluetooth
         if ":" not in target:
-            devices = await BleakScanner.discover(timeout=5.0)
-            match = next(
-                (d for d in devices if (d.name or "").lower().startswith(target.lower())),
-                None,
+            prefix = target.lower()
+            # Stops scanning at the first match instead of always waiting out the timeout
+            match = await BleakScanner.find_device_by_filter(
+                lambda d, adv: (d.name or adv.local_name or "").lower().startswith(prefix),
+                timeout=5.0,
             )
             if not match:
                 raise RuntimeError(f"No BLE device found matching '{target}'")
             address, name = match.address, match.name or target
         else:
-            devices = await BleakScanner.discover(timeout=5.0)
-            match = next((d for d in devices if d.address.lower() == target.lower()), None)
-            address, name = target, (match.name if match else target)
+            if self.args.model:
+                # Nothing a scan could tell us: the address and model are both given
+                return target, _resolve_model(target, self.args.model)
+            # Only the advertised name is needed, to auto-detect the model;
+            # find_device_by_address stops scanning as soon as it is seen.
+            device = await BleakScanner.find_device_by_address(target, timeout=5.0)
+            address, name = target, ((device.name if device else None) or target)
+
+        return address, _resolve_model(name, self.args.model)
+
+    async def _ble_model(self) -> PrinterModel:
+        if self._model is None:
+            async with self._connect_lock:
+                if self._model is None:
+                    self._address, self._model = await self._discover()
+        return self._model
+
+    async def _connect(self) -> BleakClient:
+        """Return a connected client, scanning and connecting only if needed."""
+        from bleak import BleakClient
+
+        async with self._connect_lock:
+            # Another job may have reconnected while we waited for the lock
+            if self._client is not None and self._client.is_connected:
+                return self._client
+            if self._address is None or self._model is None:
+                self._address, self._model = await self._discover()
+            client = BleakClient(self._address, disconnected_callback=self._on_disconnect)
+            try:
+                await client.connect()
+            except Exception:
+                # The printer may have moved address; rescan on the next job
+                self._address = self._model = None
+                raise
+            # BlueZ only learns the negotiated ATT MTU once it is explicitly
+            # acquired; other backends negotiate it during connect.
+            acquire_mtu = getattr(getattr(client, "_backend", None), "_acquire_mtu", None)
+            if acquire_mtu is not None:
+                try:
+                    await acquire_mtu()
+                except Exception as exc:
+                    print(f"[BLE] Could not acquire MTU, using default: {exc}", file=sys.stderr, flush=True)
+            char = client.services.get_characteristic(BLE_WRITE_UUID)
+            if char is None:
+                await client.disconnect()
+                raise RuntimeError(f"Printer has no write characteristic {BLE_WRITE_UUID}")
+            self._char = char
+            self._write_without_response = "write-without-response" in char.properties
+            if self._write_without_response:
+                # The characteristic reports what actually fits in one packet
+                self._payload_size = max(20, char.max_write_without_response_size)
+            else:
+                self._payload_size = max(20, client.mtu_size - 3)
+            self._client = client
+            return client
+
+    def _on_disconnect(self, client: BleakClient) -> None:
+        if client is self._client:
+            self._client = None
+            print("[BLE] Printer disconnected; will reconnect on next job.", flush=True)
+
+    async def _print_ble(self, data: bytes, model: PrinterModel) -> None:
+        client = self._client
+        if client is None or not client.is_connected:
+            client = await self._connect()
+
+        mtu = self.args.mtu or min(model.img_mtu or self._payload_size, self._payload_size)
+        char = self._char
+        view = memoryview(data)  # slices share the payload buffer instead of copying it
+
+        if self._write_without_response:
+            # Sliding window: keep a bounded number of writes in flight so the
+            # adapter's queue stays full without being overrun, topping it up
+            # as each one completes and failing fast on the first error.
+            window = self.args.ble_inflight or BLE_INFLIGHT_DEFAULT
+            pending: dict[asyncio.Task[None], int] = {}  # write -> payload offset
+            try:
+                for i in range(0, len(data), mtu):
+                    if len(pending) >= window:
+                        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        _raise_first_error(done, pending)
+                    write = client.write_gatt_char(char, view[i : i + mtu], response=False)
+                    pending[asyncio.create_task(write)] = i
+                if pending:
+                    done, _ = await asyncio.wait(pending)
+                    _raise_first_error(done, pending)
+            finally:
+                # No write may outlive the device lock, and each one's
+                # exception must be retrieved or asyncio logs it
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+            return
 
-        model = resolve_model(self._registry, name, self.args.model)
-        data = build_print_data(display_text, qr_data, model)
-        mtu = model.img_mtu or 20
+        # Pace against a fixed schedule rather than sleeping a flat interval
+        # after each write, so event-loop wake-up lag doesn't accumulate.
         interval = (model.interval_ms or 4) / 1000
-
-        async with BleakClient(address) as client:
-            for i in range(0, len(data), mtu):
-                await client.write_gatt_char(BLE_WRITE_UUID, data[i : i + mtu], response=False)
-                await asyncio.sleep(interval)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        for i in range(0, len(data), mtu):
+            await client.write_gatt_char(char, view[i : i + mtu], response=False)
+            deadline += interval
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
 
 
-class _PrintHandler(BaseHTTPRequestHandler):
-    _server: PrintServer
+USAGE = "Usage: GET /print?text=...&qr=...[&qronly=1] or POST /print with JSON body.\n"
 
-    def log_message(self, fmt: str, *args: object) -> None:
-        print(f"[{self.address_string()}] {fmt % args}", flush=True)
 
-    def _extract_params(self) -> tuple[str, str | None] | None:
-        """Return (display_text, qr_data), or None if the request cannot be handled.
+def _flag(value: object) -> bool:
+    return str(value).lower() in ("1", "true", "yes", "on")
 
-        qr_data=None means text-only mode (no QR code, full-width text).
-        The presence of the "qr" key — not its value — determines the mode.
-        "text" may be a plain string, or a nested JSON object/array which is
-        formatted into readable plain text via _format_value.
 
-        Sends an error response before returning None when the path matched /print
-        but the payload was malformed; the caller must not send a second response.
-        """
-        qs = parse_qs(urlparse(self.path).query)
-        text_param = qs["text"][0] if "text" in qs else None
-        qr_param = qs["qr"][0] if "qr" in qs else None
+def _respond(status: int, body: str) -> Response:
+    return PlainTextResponse(body, status_code=status)
 
-        if text_param is not None or qr_param is not None:
-            if qr_param is not None:
-                # QR mode: text falls back to the qr value if not provided
-                return (text_param if text_param is not None else qr_param), qr_param
-            else:
-                # Text-only mode
-                return text_param, None
 
-        if self.command == "POST":
-            try:
-                length = int(self.headers.get("Content-Length", 0))
-            except ValueError:
-                self._respond(400, "Invalid Content-Length.\n")
-                return None
-            if length < 0:
-                self._respond(400, "Invalid Content-Length.\n")
-                return None
-            if length > MAX_BODY_BYTES:
-                self._respond(413, f"Request body too large (max {MAX_BODY_BYTES} bytes).\n")
-                return None
-            if length:
-                raw = self.rfile.read(length).decode("utf-8", errors="replace")
-                try:
-                    body = json.loads(raw)
-                except json.JSONDecodeError:
-                    self._respond(400, "Invalid JSON body.\n")
-                    return None
-                if not isinstance(body, dict):
-                    self._respond(400, "JSON body must be an object.\n")
-                    return None
-                text_val = body.get("text")
-                qr_val = body.get("qr")
-                if text_val is None and qr_val is None:
-                    # Bare object — treat the whole body as the text content
-                    return _format_value(body), None
-                if qr_val is not None and not isinstance(qr_val, str):
-                    self._respond(400, '"qr" must be a string.\n')
-                    return None
-                display_text = _format_value(text_val if text_val is not None else qr_val)
-                return display_text, qr_val  # qr_val is str or None
+async def _extract_params(request: Request) -> tuple[str, str | None, bool] | Response:
+    """Return (display_text, qr_data, qr_only), or an error response if the request cannot be handled.
 
-        return None
-
-    def _respond(self, status: int, body: str) -> None:
-        encoded = body.encode("utf-8")
-        self.send_response(status)
-        self.send_header("Content-Type", "text/plain; charset=utf-8")
-        self.send_header("Content-Length", str(len(encoded)))
-        self.end_headers()
-        self.wfile.write(encoded)
-
-    def _handle(self) -> None:
-        if urlparse(self.path).path != "/print":
-            self._respond(404, "Not found.\n\nUsage: GET /print?text=...&qr=... or POST /print with JSON body.\n")
-            return
-        params = self._extract_params()
-        if params is None:
-            return  # error response already sent by _extract_params
-        display_text, qr_data = params
-        if not display_text.strip():
-            self._respond(400, "Empty text.\n")
-            return
+    qr_data=None means text-only mode (no QR code, full-width text).
+    The presence of the "qr" key — not its value — determines the mode.
+    qr_only=True ("qronly") prints the QR code alone at full width.
+    "text" may be a plain string, or a nested JSON object/array which is
+    formatted into readable plain text via _format_value.
+    """
+    qs = request.query_params
+    # Blank values count as absent, as they did with parse_qs, so clients
+    # sending empty form fields keep working
+    text_param = qs.get("text") or None
+    qr_param = qs.get("qr") or None
+    # May also come with a JSON body, so only enforce "requires qr" once
+    # we know where the qr value is coming from
+    query_qr_only = _flag(qs.get("qronly"))
+
+    if text_param is not None or qr_param is not None:
+        if qr_param is not None:
+            # QR mode: text falls back to the qr value if not provided
+            return (text_param if text_param is not None else qr_param), qr_param, query_qr_only
+        if query_qr_only:
+            return _respond(400, '"qronly" requires "qr".\n')
+        # Text-only mode
+        return text_param, None, False
+
+    if request.method == "POST":
         try:
-            self._server.print_text(display_text, qr_data)
-            self._respond(200, "OK\n")
-        except Exception as exc:
-            print(f"[ERROR] {exc}", file=sys.stderr, flush=True)
-            self._respond(500, "Print error — check server logs.\n")
-
-    def do_GET(self) -> None:
-        self._handle()
-
-    def do_POST(self) -> None:
-        self._handle()
-
+            length = int(request.headers.get("Content-Length", 0))
+        except ValueError:
+            return _respond(400, "Invalid Content-Length.\n")
+        if length < 0:
+            return _respond(400, "Invalid Content-Length.\n")
+        if length > MAX_BODY_BYTES:
+            return _respond(413, f"Request body too large (max {MAX_BODY_BYTES} bytes).\n")
+        if length:
+            content_type = request.headers.get("Content-Type")
+            if content_type is not None and not content_type.lower().startswith("application/json"):
+                return _respond(415, "Content-Type must be application/json.\n")
+            # Stream the body so a client lying about Content-Length can't
+            # make us buffer more than MAX_BODY_BYTES.
+            raw = bytearray()
+            async for chunk in request.stream():
+                raw += chunk
+                if len(raw) > MAX_BODY_BYTES:
+                    return _respond(413, f"Request body too large (max {MAX_BODY_BYTES} bytes).\n")
+            try:
+                body = _json.loads(raw)
+            except ValueError:  # JSONDecodeError, or UnicodeDecodeError on bad UTF-8
+                return _respond(400, "Invalid JSON body.\n")
+            if not isinstance(body, dict):
+                return _respond(400, "JSON body must be an object.\n")
+            text_val = body.get("text")
+            qr_val = body.get("qr")
+            if text_val is None and qr_val is None:
+                if query_qr_only or _flag(body.get("qronly")):
+                    return _respond(400, '"qronly" requires "qr".\n')
+                # Bare object — treat the whole body as the text content
+                return _format_value(body), None, False
+            if qr_val is not None and not isinstance(qr_val, str):
+                return _respond(400, '"qr" must be a string.\n')
+            qr_only = query_qr_only or _flag(body.get("qronly"))
+            if qr_only and qr_val is None:
+                return _respond(400, '"qronly" requires "qr".\n')
+            display_text = _format_value(text_val if text_val is not None else qr_val)
+            return display_text, qr_val, qr_only  # qr_val is str or None
+
+    if query_qr_only:
+        return _respond(400, '"qronly" requires "qr".\n')
+    return _respond(400, "Missing text or qr.\n\n" + USAGE)
+
+
+async def _handle(request: Request) -> Response:
+    server: PrintServer = request.app.state.server
+    params = await _extract_params(request)
+    if isinstance(params, Response):
+        return params
+    display_text, qr_data, qr_only = params
+    if not display_text.strip():
+        return _respond(400, "Empty text.\n")
+    if server.busy:
+        # Fail fast rather than leave the client hanging behind a long queue
+        return _respond(503, "Printer busy — try again shortly.\n")
+    try:
+        await server.print_text(display_text, qr_data, qr_only)
+    except Exception as exc:
+        print(f"[ERROR] {exc}", file=sys.stderr, flush=True)
+        return _respond(500, "Print error — check server logs.\n")
+    return _respond(200, "OK\n")
+
+
+async def _not_found(request: Request, exc: Exception) -> Response:
+    return _respond(404, "Not found.\n\n" + USAGE)
+
+
+def _make_app(server: PrintServer) -> Starlette:
+    @contextlib.asynccontextmanager
+    async def lifespan(app: Starlette) -> AsyncIterator[None]:
+        # Warm up in the background so the server accepts requests immediately
+        warm_up = asyncio.create_task(server.start())
+        # SIGHUP clears the render caches. Not available on Windows, or when
+        # the loop isn't running in the main thread (e.g. under a test client).
+        loop = asyncio.get_running_loop()
+        with contextlib.suppress(AttributeError, NotImplementedError, RuntimeError):
+            loop.add_signal_handler(signal.SIGHUP, server.clear_caches)
+        yield
+        with contextlib.suppress(AttributeError, NotImplementedError, RuntimeError):
+            loop.remove_signal_handler(signal.SIGHUP)
+        warm_up.cancel()
+        await server.close()
+
+    app = Starlette(
+        routes=[Route("/print", _handle, methods=["GET", "POST"])],
+        exception_handlers={404: _not_found},
+        lifespan=lifespan,
+    )
+    app.state.server = server
+    return app
 
-def _make_handler(server: PrintServer) -> type:
-    class Handler(_PrintHandler):
-        _server = server
 
-    return Handler
+def _positive_int(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
 
 
 def parse_args() -> argparse.Namespace:
@@ -336,12 +828,36 @@ def parse_args() -> argparse.Namespace:
         default=os.environ.get("PRINTER_MODEL"),
         help="Printer model override (env: PRINTER_MODEL)",
     )
+    parser.add_argument(
+        "--mtu",
+        type=_positive_int,
+        default=os.environ.get("PRINTER_MTU"),
+        help="BLE write chunk size in bytes (env: PRINTER_MTU, default: negotiated ATT MTU - 3)",
+    )
+    parser.add_argument(
+        "--ble-inflight",
+        type=_positive_int,
+        default=os.environ.get("PRINTER_BLE_INFLIGHT"),
+        help=f"BLE writes kept in flight (env: PRINTER_BLE_INFLIGHT, default: {BLE_INFLIGHT_DEFAULT})",
+    )
+    parser.add_argument(
+        "--ble-adapter",
+        metavar="HCI",
+        default=os.environ.get("PRINTER_BLE_ADAPTER", "hci0"),
+        help="BlueZ adapter whose connection interval is tuned (env: PRINTER_BLE_ADAPTER, default: hci0)",
+    )
     parser.add_argument(
         "--port",
         type=int,
         default=int(os.environ.get("PRINT_PORT", 8080)),
         help="HTTP port (env: PRINT_PORT, default: 8080)",
     )
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        default=int(os.environ.get("PRINT_MAX_QUEUE", 16)),
+        help="Jobs accepted at once before answering 503 (env: PRINT_MAX_QUEUE, default: 16, 0 = no limit)",
+    )
     parser.add_argument(
         "--host",
         default=os.environ.get("PRINT_HOST", "0.0.0.0"),
@@ -359,15 +875,17 @@ def main() -> int:
         )
         return 2
 
-    server = PrintServer(args)
-    httpd = HTTPServer((args.host, args.port), _make_handler(server))
+    try:
+        # Serial mode resolves --model here, so a bad one stops startup
+        server = PrintServer(args)
+    except Exception as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return 2
     print(f"Print server listening on {args.host}:{args.port}", flush=True)
     print(f"  GET  http://{args.host}:{args.port}/print?text=...&qr=...")
     print(f"  POST http://{args.host}:{args.port}/print  (JSON: {{\"text\": \"...\", \"qr\": \"...\"}})")
-    try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        print("\nShutting down.")
+    # A single Uvicorn worker owns the one event loop that all print jobs share
+    uvicorn.run(_make_app(server), host=args.host, port=args.port)
     return 0
 
 